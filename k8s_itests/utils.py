@@ -1,16 +1,14 @@
 import os
+import shlex
 import subprocess
-from subprocess import PIPE
 
 
 def cmd(args, capture_output=True):
+    argv = args if isinstance(args, (list, tuple)) else shlex.split(args)
     if capture_output:
-        ret = subprocess.run(args.split(" "), stdout=PIPE, stderr=PIPE)
-        ret.stdout = ret.stdout.decode("utf-8")
-        ret.stderr = ret.stderr.decode("utf-8")
-        return ret
+        return subprocess.run(argv, capture_output=True, text=True)
     else:
-        return subprocess.run(args.split(" "))
+        return subprocess.run(argv)
 
 
 def start_paasta_api():
@@ -27,9 +25,9 @@ def paasta_apply():
     print("Applying SOA configurations")
     service_instances = cmd("python -m paasta_tools.list_kubernetes_service_instances")
     cmd(
-        "python -m paasta_tools.setup_kubernetes_job {} -v".format(
-            service_instances.stdout.strip()
-        ),
+        ["python", "-m", "paasta_tools.setup_kubernetes_job"]
+        + service_instances.stdout.split()
+        + ["-v"],
         False,
     )
 
@@ -11,7 +11,7 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import os
+import shutil
 
 from behave import then
 from behave import when
@@ -33,9 +33,7 @@ def delete_apps(context, job_id, cluster_name):
     )
     update_context_marathon_config(context)
     context.app_id = context.marathon_complete_config["id"]
-    os.remove(f"{context.soa_dir}/{service}/marathon-{cluster_name}.yaml")
-    os.remove(f"{context.soa_dir}/{service}/deployments.json")
-    os.rmdir(f"{context.soa_dir}/{service}")
+    shutil.rmtree(f"{context.soa_dir}/{service}")
 
 
 @then(
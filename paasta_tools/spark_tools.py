@@ -1,17 +1,31 @@
+import re
 import socket
+from functools import lru_cache
 
 
 DEFAULT_SPARK_SERVICE = "spark"
 
+_SPARK_BASE_CMD_RE = re.compile(r"(pyspark|spark-shell|spark-submit)\b")
+
+
+@lru_cache(maxsize=1)
+def _hostname() -> str:
+    # gethostname is enough for humans clicking web UI links within a cluster
+    # and, unlike getfqdn, never blocks on reverse DNS
+    return socket.gethostname()
+
 
 def get_webui_url(port: str) -> str:
-    return f"http://{socket.getfqdn()}:{port}"
+    return f"http://{_hostname()}:{port}"
 
 
 def inject_spark_conf_str(original_docker_cmd: str, spark_conf_str: str) -> str:
-    for base_cmd in ("pyspark", "spark-shell", "spark-submit"):
-        if base_cmd in original_docker_cmd:
-            return original_docker_cmd.replace(
-                base_cmd, base_cmd + " " + spark_conf_str, 1
-            )
-    return original_docker_cmd
+    match = _SPARK_BASE_CMD_RE.search(original_docker_cmd)
+    if not match:
+        return original_docker_cmd
+    return (
+        original_docker_cmd[: match.end()]
+        + " "
+        + spark_conf_str
+        + original_docker_cmd[match.end() :]
+    )
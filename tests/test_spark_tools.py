@@ -6,7 +6,8 @@ from paasta_tools import spark_tools
 
 
 def test_get_webui_url():
-    with mock.patch("socket.getfqdn", return_value="1.2.3.4"):
+    spark_tools._hostname.cache_clear()
+    with mock.patch("socket.gethostname", return_value="1.2.3.4"):
         assert spark_tools.get_webui_url("1234") == "http://1.2.3.4:1234"
 
 